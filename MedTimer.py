@@ -7,6 +7,13 @@ import io
 import plotly.graph_objects as go
 import tempfile
 import random
+import zlib
+import cProfile
+import pstats
+import marshal
+import threading
+import contextlib
+from time import perf_counter
 from datetime import datetime, date, time, timedelta
 from reportlab.lib.pagesizes import A4
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
@@ -25,18 +32,21 @@ st.set_page_config(
 )
 
 # --------------------------------------------------
-# DATABASE INITIALIZATION
+# DATABASE INITIALIZATION (SHARDED STORAGE)
 # --------------------------------------------------
-@st.cache_resource
-def get_db_connection():
-    db_path = os.path.join(os.getcwd(), "users.db")
-    conn = sqlite3.connect(db_path, check_same_thread=False, timeout=20)
-    return conn
-
-conn = get_db_connection()
-cur = conn.cursor()
-
-try:
+# Each user lives on one shard file. Shard 0 is the original users.db so
+# existing accounts keep working; a small directory database maps every
+# username to its shard so login only has to open one shard.
+NUM_SHARDS = max(1, int(os.environ.get("MEDTIMER_SHARDS", "4")))
+DATA_DIR = os.environ.get("MEDTIMER_DATA_DIR", os.getcwd())
+
+def shard_path(shard_id):
+    if shard_id == 0:
+        return os.path.join(DATA_DIR, "users.db")
+    return os.path.join(DATA_DIR, f"users_shard_{shard_id}.db")
+
+def init_shard_schema(conn):
+    cur = conn.cursor()
     cur.execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, age INTEGER, username TEXT UNIQUE, password_hash TEXT)")
     cur.execute('''CREATE TABLE IF NOT EXISTS medicines (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -47,26 +57,266 @@ try:
                     times TEXT,
                     doses_json TEXT)''')
     cur.execute("CREATE TABLE IF NOT EXISTS user_settings (username TEXT PRIMARY KEY, language TEXT, bg_color TEXT, font_family TEXT, font_size INTEGER)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_medicines_username ON medicines (username)")
+    cur.execute('''CREATE TABLE IF NOT EXISTS medicine_archive (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT,
+                    med_name TEXT,
+                    start_date TEXT,
+                    days INTEGER,
+                    times TEXT,
+                    taken_count INTEGER,
+                    dose_count INTEGER,
+                    daily_json TEXT,
+                    doses_blob BLOB,
+                    archived_at TEXT)''')
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_archive_username ON medicine_archive (username)")
+    cur.execute("CREATE TABLE IF NOT EXISTS maintenance (task TEXT PRIMARY KEY, last_run TEXT)")
     conn.commit()
+
+    # MIGRATION: older databases may miss these columns
+    for column, definition in (("med_name", "TEXT"), ("doses_json", "TEXT")):
+        try:
+            cur.execute(f"SELECT {column} FROM medicines LIMIT 1")
+        except sqlite3.OperationalError:
+            try:
+                cur.execute(f"ALTER TABLE medicines ADD COLUMN {column} {definition}")
+                conn.commit()
+            except:
+                pass
+
+@st.cache_resource
+def get_shard_connection(shard_id):
+    conn = sqlite3.connect(shard_path(shard_id), check_same_thread=False, timeout=20)
+    # New shards free archived pages with incremental vacuum instead of a
+    # full VACUUM; this only takes effect before the first table exists
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # WAL lets readers on a shard proceed while another session writes to it
+    conn.execute("PRAGMA journal_mode=WAL")
+    init_shard_schema(conn)
+    return conn
+
+@st.cache_resource
+def get_directory_connection():
+    conn = sqlite3.connect(os.path.join(DATA_DIR, "directory.db"), check_same_thread=False, timeout=20)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS user_shards (username TEXT PRIMARY KEY, shard_id INTEGER NOT NULL)")
+
+    # Accounts created before sharding already live in users.db (shard 0)
+    legacy = get_shard_connection(0).execute("SELECT username FROM users").fetchall()
+    conn.executemany("INSERT OR IGNORE INTO user_shards (username, shard_id) VALUES (?, 0)", legacy)
+    conn.commit()
+    return conn
+
+def pick_shard(username):
+    digest = hashlib.sha256(username.encode()).hexdigest()
+    return int(digest, 16) % NUM_SHARDS
+
+def lookup_shard(username):
+    row = get_directory_connection().execute(
+        "SELECT shard_id FROM user_shards WHERE username=?", (username,)
+    ).fetchone()
+    return row[0] if row else None
+
+def get_user_db(username):
+    # No mapping means the account is gone or was renamed elsewhere; callers
+    # must not fall back to a default shard and write orphan rows there
+    shard_id = lookup_shard(username)
+    if shard_id is None:
+        return None
+    conn = get_shard_connection(shard_id)
+    return shard_id, conn, conn.cursor()
+
+try:
+    directory_conn = get_directory_connection()
 except sqlite3.OperationalError as e:
     st.error(f"Database Error: {e}")
     st.stop()
 
 # --------------------------------------------------
-# MIGRATION HELPER
+# ARCHIVAL & COMPACTION
 # --------------------------------------------------
-def add_column_if_missing(table, column, definition):
-    try:
-        cur.execute(f"SELECT {column} FROM {table} LIMIT 1")
-    except sqlite3.OperationalError:
+# Courses whose last dose is more than ARCHIVE_AFTER_DAYS old move out of
+# `medicines` into `medicine_archive`: per-day taken/total counts plus the
+# original doses zlib-compressed. Waiting a week keeps the weekly chart fed
+# from live data. The first login of the day on a shard claims that day's
+# compaction and runs it on a background thread with its own connection.
+ARCHIVE_AFTER_DAYS = 7
+
+def load_doses(doses_json):
+    doses = json.loads(doses_json)
+    for d in doses:
+        d["datetime"] = datetime.strptime(d["datetime"], "%Y-%m-%d %H:%M:%S")
+        if d.get("taken_time"):
+            d["taken_time"] = datetime.strptime(d["taken_time"], "%Y-%m-%d %H:%M:%S")
+    return doses
+
+def summarize_doses(doses_json):
+    daily = {}
+    for d in json.loads(doses_json or "[]"):
+        day = daily.setdefault(d["datetime"][:10], [0, 0])
+        day[0] += 1 if d["taken"] else 0
+        day[1] += 1
+    return daily
+
+def compact_finished_courses(conn):
+    cur = conn.cursor()
+    cutoff = date.today() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    # start_date + days is the day after the last dose, so no JSON decoding
+    # is needed to find finished courses
+    cur.execute(
+        "SELECT id, username, med_name, start_date, days, times, doses_json FROM medicines "
+        "WHERE date(start_date, '+' || days || ' days') <= ?",
+        (str(cutoff),)
+    )
+    finished = cur.fetchall()
+
+    archived = 0
+    for med_id, username, med_name, start_date, days, times, doses_json in finished:
         try:
-            cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
-            conn.commit()
-        except:
-            pass
+            daily = summarize_doses(doses_json)
+        except (json.JSONDecodeError, KeyError, TypeError):
+            # Leave malformed courses live rather than lose their doses
+            continue
+
+        # Only archive rows this run actually removed, so a course can never
+        # end up in the archive twice
+        cur.execute("DELETE FROM medicines WHERE id=?", (med_id,))
+        if cur.rowcount != 1:
+            continue
+        cur.execute(
+            """
+            INSERT INTO medicine_archive
+            (username, med_name, start_date, days, times, taken_count, dose_count, daily_json, doses_blob, archived_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                username,
+                med_name,
+                start_date,
+                days,
+                times,
+                sum(v[0] for v in daily.values()),
+                sum(v[1] for v in daily.values()),
+                json.dumps(daily),
+                zlib.compress((doses_json or "[]").encode()),
+                datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            )
+        )
+        archived += 1
+    conn.commit()
+    return archived
 
-add_column_if_missing("medicines", "med_name", "TEXT")
-add_column_if_missing("medicines", "doses_json", "TEXT")
+def claim_compaction(conn):
+    today = str(date.today())
+    # Plain read first so ordinary logins never write to the shard
+    row = conn.execute("SELECT last_run FROM maintenance WHERE task='compaction'").fetchone()
+    if row and row[0] == today:
+        return False
+
+    # A single UPDATE is atomic, so only one session per shard wins the day
+    conn.execute("INSERT OR IGNORE INTO maintenance (task, last_run) VALUES ('compaction', NULL)")
+    cur = conn.execute(
+        "UPDATE maintenance SET last_run=? WHERE task='compaction' AND last_run IS NOT ?",
+        (today, today)
+    )
+    conn.commit()
+    return cur.rowcount == 1
+
+def run_compaction(shard_id):
+    conn = sqlite3.connect(shard_path(shard_id), timeout=20)
+    try:
+        compact_finished_courses(conn)
+        conn.execute("ANALYZE")
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # Shards created before incremental vacuum need one full VACUUM
+            # to switch modes; after that only freed pages are released
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+        else:
+            # executescript steps the pragma to completion; a plain
+            # execute() frees only a single page
+            conn.executescript("PRAGMA incremental_vacuum;")
+        conn.commit()
+    except sqlite3.Error:
+        # Tomorrow's run will pick up whatever was left behind
+        conn.rollback()
+    finally:
+        conn.close()
+
+def schedule_compaction(shard_id):
+    if claim_compaction(get_shard_connection(shard_id)):
+        threading.Thread(target=run_compaction, args=(shard_id,), daemon=True).start()
+
+def load_archived_meds(cur, username):
+    cur.execute(
+        "SELECT med_name, doses_blob FROM medicine_archive WHERE username=? ORDER BY start_date",
+        (username,)
+    )
+    return [
+        {"name": row[0], "doses": load_doses(zlib.decompress(row[1]).decode())}
+        for row in cur.fetchall()
+    ]
+
+# --------------------------------------------------
+# PROFILING (OPT-IN)
+# --------------------------------------------------
+# Set MEDTIMER_PROFILE=1 to profile named page sections. Results are shared
+# by every session in this process. Only the usernames listed in
+# MEDTIMER_PROFILE_ADMIN (comma-separated) see them in Settings, where they
+# can be downloaded as a pstats file (works with snakeviz, gprof2dot or
+# flameprof) or reset.
+PROFILING = os.environ.get("MEDTIMER_PROFILE", "") not in ("", "0")
+# Admin rights come from the username alone: register these accounts before
+# enabling profiling, or any patient could claim an unused admin name
+PROFILE_ADMINS = {u.strip() for u in os.environ.get("MEDTIMER_PROFILE_ADMIN", "").split(",") if u.strip()}
+
+@st.cache_resource
+def get_profile_store():
+    return {
+        "lock": threading.Lock(),
+        # Only one cProfile may run at a time; other sessions get wall time only
+        "profiler_lock": threading.Lock(),
+        "stats": {},
+        "timings": {}
+    }
+
+@contextlib.contextmanager
+def profile_section(name):
+    if not PROFILING:
+        yield
+        return
+
+    store = get_profile_store()
+    profiler = cProfile.Profile() if store["profiler_lock"].acquire(blocking=False) else None
+    start = perf_counter()
+    try:
+        if profiler:
+            profiler.enable()
+        yield
+    finally:
+        elapsed = perf_counter() - start
+        if profiler:
+            profiler.disable()
+            store["profiler_lock"].release()
+        with store["lock"]:
+            count, total = store["timings"].get(name, (0, 0.0))
+            store["timings"][name] = (count + 1, total + elapsed)
+            if profiler:
+                if name in store["stats"]:
+                    store["stats"][name].add(profiler)
+                else:
+                    store["stats"][name] = pstats.Stats(profiler)
+
+def export_profile(section=None):
+    store = get_profile_store()
+    with store["lock"]:
+        combined = pstats.Stats()
+        if section:
+            combined.add(store["stats"][section])
+        else:
+            combined.add(*store["stats"].values())
+        return marshal.dumps(combined.stats)
 
 # --------------------------------------------------
 # HELPERS & AUTH FUNCTIONS
@@ -75,21 +325,41 @@ def hash_pw(pw):
     return hashlib.sha256(pw.encode()).hexdigest()
 
 def create_user(name, age, username, password):
+    shard_id = pick_shard(username)
     try:
-        cur.execute(
+        # The directory primary key keeps usernames unique across all shards
+        directory_conn.execute(
+            "INSERT INTO user_shards (username, shard_id) VALUES (?, ?)",
+            (username, shard_id)
+        )
+        directory_conn.commit()
+    except sqlite3.IntegrityError:
+        return False
+
+    shard_conn = get_shard_connection(shard_id)
+    try:
+        shard_conn.execute(
             "INSERT INTO users (name, age, username, password_hash) VALUES (?, ?, ?, ?)",
             (name, age, username, hash_pw(password))
         )
-        cur.execute(
+        shard_conn.execute(
             "INSERT INTO user_settings VALUES (?, ?, ?, ?, ?)",
             (username, "English", "#ffffff", "sans-serif", 16)
         )
-        conn.commit()
+        shard_conn.commit()
         return True
     except:
+        shard_conn.rollback()
+        directory_conn.execute("DELETE FROM user_shards WHERE username=?", (username,))
+        directory_conn.commit()
         return False
 
 def login_user(username, password):
+    user_db = get_user_db(username)
+    if user_db is None:
+        return None
+    shard_id, conn, cur = user_db
+
     cur.execute(
         "SELECT name, age FROM users WHERE username=? AND password_hash=?",
         (username, hash_pw(password))
@@ -110,28 +380,61 @@ def login_user(username, password):
         
         st.session_state.meds = []
         for row in db_meds:
-            m_name = row[0]
-            m_doses = json.loads(row[1]) 
-            for d in m_doses:
-                d["datetime"] = datetime.strptime(d["datetime"], "%Y-%m-%d %H:%M:%S")
-                if d.get("taken_time"):
-                    d["taken_time"] = datetime.strptime(d["taken_time"], "%Y-%m-%d %H:%M:%S")
-            st.session_state.meds.append({"name": m_name, "doses": m_doses})
+            st.session_state.meds.append({"name": row[0], "doses": load_doses(row[1])})
+
+        cur.execute(
+            "SELECT COALESCE(SUM(taken_count), 0), COALESCE(SUM(dose_count), 0) FROM medicine_archive WHERE username=?",
+            (username,)
+        )
+        st.session_state.archived_totals = cur.fetchone()
+
+        # Started after this session's loads so it cannot move a course
+        # between the two queries above
+        schedule_compaction(shard_id)
+        st.session_state.timeline = None
             
     return user_data
 
+def rename_user_rows(cur, old_u, new_u, password_hash):
+    cur.execute("UPDATE users SET username=?, password_hash=? WHERE username=?", (new_u, password_hash, old_u))
+    cur.execute("UPDATE user_settings SET username=? WHERE username=?", (new_u, old_u))
+    cur.execute("UPDATE medicines SET username=? WHERE username=?", (new_u, old_u))
+    cur.execute("UPDATE medicine_archive SET username=? WHERE username=?", (new_u, old_u))
+
 def update_credentials(old_u, old_p, new_u, new_p):
+    user_db = get_user_db(old_u)
+    if user_db is None:
+        return False
+    _, conn, cur = user_db
+
     cur.execute("SELECT * FROM users WHERE username=? AND password_hash=?", (old_u, hash_pw(old_p)))
-    if cur.fetchone():
-        try:
-            cur.execute("UPDATE users SET username=?, password_hash=? WHERE username=?", (new_u, hash_pw(new_p), old_u))
-            cur.execute("UPDATE user_settings SET username=? WHERE username=?", (new_u, old_u))
-            cur.execute("UPDATE medicines SET username=? WHERE username=?", (new_u, old_u))
-            conn.commit()
-            return True
-        except sqlite3.IntegrityError:
-            return "exists"
-    return False
+    if not cur.fetchone():
+        return False
+    if new_u != old_u and lookup_shard(new_u) is not None:
+        return "exists"
+
+    # The user's rows stay on their shard. Commit the shard first so the
+    # directory write lock is only held for its own single UPDATE.
+    try:
+        rename_user_rows(cur, old_u, new_u, hash_pw(new_p))
+        conn.commit()
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return "exists"
+    except:
+        conn.rollback()
+        return False
+
+    try:
+        directory_conn.execute("UPDATE user_shards SET username=? WHERE username=?", (new_u, old_u))
+        directory_conn.commit()
+        return True
+    except Exception as e:
+        directory_conn.rollback()
+        # Put the shard rows back so they still match the directory
+        rename_user_rows(cur, new_u, old_u, hash_pw(old_p))
+        conn.commit()
+        return "exists" if isinstance(e, sqlite3.IntegrityError) else False
 
 # --------------------------------------------------
 # SESSION STATE & TRANSLATIONS
@@ -147,7 +450,9 @@ defaults = {
     "bg_color": "#ffffff",
     "font_family": "sans-serif",
     "font_size": 16,
-    "reminded_doses": set()
+    "reminded_doses": set(),
+    "timeline": None,
+    "archived_totals": (0, 0)
 }
 
 for k, v in defaults.items():
@@ -167,7 +472,8 @@ LANG_DATA = {
         "new_username": "New Username", "new_password": "New Password", "btn_update_auth": "Update Credentials",
         "pdf_report_title": "Medication Adherence Report", "patient": "Patient", "generated": "Generated",
         "col_date": "Date", "col_day": "Day", "col_med": "Medicine", "col_sched": "Scheduled", "col_taken": "Taken At", "col_status": "Status",
-        "btn_download_pdf": "⬇️ Download PDF"
+        "btn_download_pdf": "⬇️ Download PDF",
+        "next_dose": "⏭️ Next dose: {med} in {minutes} min"
     },
     "Tamil": {
         "checklist": "📋 இன்றைய பட்டியல்", "settings": "⚙️ அமைப்புகள்", "add_med": "➕ மருந்து சேர்க்க",
@@ -181,7 +487,8 @@ LANG_DATA = {
         "new_username": "புதிய பயனர் பெயர்", "new_password": "புதிய கடவுச்சொல்", "btn_update_auth": "சான்றுகளைப் புதுப்பிக்கவும்",
         "pdf_report_title": "மருந்து பின்பற்றுதல் அறிக்கை", "patient": "நோயாளி", "generated": "உருவாக்கப்பட்டது",
         "col_date": "தேதி", "col_day": "நாள்", "col_med": "மருந்து", "col_sched": "நேரம்", "col_taken": "எடுத்த நேரம்", "col_status": "நிலை",
-        "btn_download_pdf": "⬇️ PDF பதிவிறக்கம்"
+        "btn_download_pdf": "⬇️ PDF பதிவிறக்கம்",
+        "next_dose": "⏭️ அடுத்த மருந்து: {med} - {minutes} நிமிடங்களில்"
     },
     "Hindi": {
         "checklist": "📋 आज की सूची", "settings": "⚙️ सेटिंग्स", "add_med": "➕ दवा जोड़ें",
@@ -195,7 +502,8 @@ LANG_DATA = {
         "new_username": "नया उपयोगकर्ता नाम", "new_password": "नया पासवर्ड", "btn_update_auth": "क्रेडेंशियल अपडेट करें",
         "pdf_report_title": "दवा अनुपालन रिपोर्ट", "patient": "रोगी", "generated": "जनरेट किया गया",
         "col_date": "तारीख", "col_day": "दिन", "col_med": "दवा", "col_sched": "निर्धारित", "col_taken": "लिया गया समय", "col_status": "स्थिति",
-        "btn_download_pdf": "⬇️ PDF डाउनलोड करें"
+        "btn_download_pdf": "⬇️ PDF डाउनलोड करें",
+        "next_dose": "⏭️ अगली खुराक: {med} - {minutes} मिनट में"
     },
     "Spanish": {
         "checklist": "📋 Lista de hoy", "settings": "⚙️ Ajustes", "add_med": "➕ Añadir medicina",
@@ -209,7 +517,8 @@ LANG_DATA = {
         "new_username": "Nuevo usuario", "new_password": "Nuevo password", "btn_update_auth": "Actualizar datos",
         "pdf_report_title": "Informe de adherencia médica", "patient": "Paciente", "generated": "Generado",
         "col_date": "Fecha", "col_day": "Día", "col_med": "Medicina", "col_sched": "Programado", "col_taken": "Tomado a las", "col_status": "Estado",
-        "btn_download_pdf": "⬇️ Descargar PDF"
+        "btn_download_pdf": "⬇️ Descargar PDF",
+        "next_dose": "⏭️ Próxima dosis: {med} en {minutes} min"
     },
     "French": {
         "checklist": "📋 Liste du jour", "settings": "⚙️ Paramètres", "add_med": "➕ Ajouter médicament",
@@ -223,7 +532,8 @@ LANG_DATA = {
         "new_username": "Nouveau nom", "new_password": "Nouveau mot de passe", "btn_update_auth": "Mettre à jour",
         "pdf_report_title": "Rapport d'observance", "patient": "Patient", "generated": "Généré",
         "col_date": "Date", "col_day": "Jour", "col_med": "Médicament", "col_sched": "Prévu", "col_taken": "Pris à", "col_status": "Statut",
-        "btn_download_pdf": "⬇️ Télécharger PDF"
+        "btn_download_pdf": "⬇️ Télécharger PDF",
+        "next_dose": "⏭️ Prochaine dose : {med} dans {minutes} min"
     },
     "German": {
         "checklist": "📋 Checkliste", "settings": "⚙️ Einstellungen", "add_med": "➕ Medizin hinzufügen",
@@ -237,7 +547,8 @@ LANG_DATA = {
         "new_username": "Neuer Name", "new_password": "Neues Passwort", "btn_update_auth": "Aktualisieren",
         "pdf_report_title": "Medikationsbericht", "patient": "Patient", "generated": "Erstellt",
         "col_date": "Datum", "col_day": "Tag", "col_med": "Medikament", "col_sched": "Geplant", "col_taken": "Zeit", "col_status": "Status",
-        "btn_download_pdf": "⬇️ PDF Herunterladen"
+        "btn_download_pdf": "⬇️ PDF Herunterladen",
+        "next_dose": "⏭️ Nächste Dosis: {med} in {minutes} Min."
     },
     "Chinese": {
         "checklist": "📋 今日清单", "settings": "⚙️ 设置", "add_med": "➕ 添加药物",
@@ -251,7 +562,8 @@ LANG_DATA = {
         "new_username": "新用户名", "new_password": "新密码", "btn_update_auth": "更新凭据",
         "pdf_report_title": "服药依从性报告", "patient": "患者", "generated": "生成日期",
         "col_date": "日期", "col_day": "星期", "col_med": "药物", "col_sched": "计划时间", "col_taken": "服用时间", "col_status": "状态",
-        "btn_download_pdf": "⬇️ 下载 PDF"
+        "btn_download_pdf": "⬇️ 下载 PDF",
+        "next_dose": "⏭️ 下一剂: {med}，{minutes} 分钟后"
     }
 }
 
@@ -261,33 +573,82 @@ def t(key):
 # --------------------------------------------------
 # STYLING & REMINDERS
 # --------------------------------------------------
-st.markdown(
-    f"""
-    <style>
-    .stApp {{ background-color: {st.session_state.bg_color} !important; }}
-    html, body, [class*="css"], .stMarkdown, p, h1, h2, h3, label {{
-        font-family: '{st.session_state.font_family}', sans-serif !important;
-        font-size: {st.session_state.font_size}px !important;
-    }}
-    </style>
-    """,
-    unsafe_allow_html=True
-)
+with profile_section("styling"):
+    st.markdown(
+        f"""
+        <style>
+        .stApp {{ background-color: {st.session_state.bg_color} !important; }}
+        html, body, [class*="css"], .stMarkdown, p, h1, h2, h3, label {{
+            font-family: '{st.session_state.font_family}', sans-serif !important;
+            font-size: {st.session_state.font_size}px !important;
+        }}
+        </style>
+        """,
+        unsafe_allow_html=True
+    )
 
-def check_medicine_reminders():
-    now = datetime.now()
+# --------------------------------------------------
+# DOSE TIMELINE
+# --------------------------------------------------
+# Today's doses sorted by time, with cursors that only move forward as the
+# clock advances. Everything before "missed" is past the take window,
+# everything before "due" has reached its time, and "next" points at the
+# first dose still waiting to be taken. Each rerun only steps the cursors
+# over doses whose time has passed since the last rerun.
+TAKE_WINDOW = 10  # minutes for "Time to Take" window
+
+def build_timeline(today):
+    entries = []
+    for mi, med in enumerate(st.session_state.meds):
+        for di, dose in enumerate(med["doses"]):
+            if dose["datetime"].date() == today:
+                entries.append({"med": med, "mi": mi, "di": di, "dose": dose})
+    entries.sort(key=lambda e: e["dose"]["datetime"])
+    return {"date": today, "entries": entries, "missed": 0, "remind": 0, "due": 0, "next": 0}
+
+def get_timeline(now):
+    timeline = st.session_state.timeline
+    if timeline is None or timeline["date"] != now.date():
+        timeline = build_timeline(now.date())
+        st.session_state.timeline = timeline
+
+    entries = timeline["entries"]
+    missed_before = now - timedelta(minutes=TAKE_WINDOW)
+    remind_before = now - timedelta(minutes=1)
+    while timeline["missed"] < len(entries) and entries[timeline["missed"]]["dose"]["datetime"] < missed_before:
+        timeline["missed"] += 1
+    while timeline["remind"] < len(entries) and entries[timeline["remind"]]["dose"]["datetime"] <= remind_before:
+        timeline["remind"] += 1
+    while timeline["due"] < len(entries) and entries[timeline["due"]]["dose"]["datetime"] <= now:
+        timeline["due"] += 1
+
+    timeline["next"] = max(timeline["next"], timeline["due"])
+    while timeline["next"] < len(entries) and entries[timeline["next"]]["dose"]["taken"]:
+        timeline["next"] += 1
+    return timeline
+
+def dose_status(timeline, index):
+    if timeline["entries"][index]["dose"]["taken"]:
+        return "taken"
+    if index < timeline["missed"]:
+        return "missed"
+    if index < timeline["due"]:
+        return "now"
+    return "upcoming"
+
+def check_medicine_reminders(timeline):
     if "notifications_done" not in st.session_state:
         st.session_state.notifications_done = set()
 
-    for med in st.session_state.meds:
-        for dose in med["doses"]:
-            if dose["datetime"].date() == now.date() and not dose["taken"]:
-                time_diff = (now - dose["datetime"]).total_seconds() / 60
-                notification_key = f"{med['name']}_{dose['datetime'].strftime('%H:%M')}"
-                if 0 <= time_diff < 1: 
-                    if notification_key not in st.session_state.notifications_done:
-                        st.toast(f"🔔 **Time for your medicine:** {med['name']}!", icon="💊")
-                        st.session_state.notifications_done.add(notification_key)
+    # Doses that reached their time within the last minute
+    for entry in timeline["entries"][timeline["remind"]:timeline["due"]]:
+        med, dose = entry["med"], entry["dose"]
+        if dose["taken"]:
+            continue
+        notification_key = f"{med['name']}_{dose['datetime'].strftime('%H:%M')}"
+        if notification_key not in st.session_state.notifications_done:
+            st.toast(f"🔔 **Time for your medicine:** {med['name']}!", icon="💊")
+            st.session_state.notifications_done.add(notification_key)
 
 # --------------------------------------------------
 # AUTHENTICATION UI
@@ -324,6 +685,13 @@ if not st.session_state.logged:
 # --------------------------------------------------
 # APP HEADER
 # --------------------------------------------------
+# From here on every query goes to the logged-in user's shard
+user_db = get_user_db(st.session_state.user)
+if user_db is None:
+    st.session_state.logged = False
+    st.rerun()
+_, conn, cur = user_db
+
 st.markdown(f"### 👤 Logged in as **{st.session_state.user}**")
 
 # --------------------------------------------------
@@ -456,6 +824,7 @@ if st.session_state.page == "Add Medicine":
                 meds_list.append(data)
 
             conn.commit()
+            st.session_state.timeline = None
             st.session_state.page = "Today's Checklist"
             st.rerun()
 
@@ -465,78 +834,80 @@ if st.session_state.page == "Add Medicine":
 # --------------------------------------------------
 if st.session_state.page == "Today's Checklist":
     st.title(t("checklist"))
-    check_medicine_reminders()
+    with profile_section("checklist_doses"):
+        now = datetime.now()
+        timeline = get_timeline(now)
+        check_medicine_reminders(timeline)
     
-    if "motivation_quote" not in st.session_state:
-        st.session_state.motivation_quote = "Every pill taken on time is a victory for your health! 🌟"
+        if "motivation_quote" not in st.session_state:
+            st.session_state.motivation_quote = "Every pill taken on time is a victory for your health! 🌟"
     
-    st.info(f"✨ **Daily Motivation:** {st.session_state.motivation_quote}")
+        st.info(f"✨ **Daily Motivation:** {st.session_state.motivation_quote}")
+
+        if timeline["next"] < len(timeline["entries"]):
+            next_entry = timeline["entries"][timeline["next"]]
+            minutes_left = int((next_entry["dose"]["datetime"] - now).total_seconds() // 60)
+            st.info(t("next_dose").format(med=next_entry["med"]["name"], minutes=minutes_left))
     
-    now = datetime.now()
-    to_delete = None
-    has_meds_today = False
-    TOLERANCE = 10  # minutes for "Time to Take" window
+        to_delete = None
+        has_meds_today = bool(timeline["entries"])
 
-    for mi, med in enumerate(st.session_state.meds):
-        for di, dose in enumerate(med["doses"]):
-            if dose["datetime"].date() == date.today():
-                has_meds_today = True
-                st.markdown(f"### 💊 {med['name']}")
-                st.write(f"⏰ {dose['datetime'].strftime('%H:%M')}")
-                
-                # CALCULATE TIME DIFFERENCE
-                time_diff = (now - dose["datetime"]).total_seconds() / 60  # in minutes
-                
-                # DETERMINE STATUS
-                if dose["taken"]:
-                    st.success(t("status_taken"))
-                elif 0 <= time_diff <= TOLERANCE:
-                    st.success(f"🌟 {t('status_now')}")
-                elif time_diff > TOLERANCE:
-                    st.error(t("status_missed"))
-                else:  # time_diff < 0
-                    st.warning(t("status_upcoming"))
-
-                # ACTION BUTTONS
-                c1, c2, c3 = st.columns(3)
-
-                if c1.button(f"✅ {t('btn_taken')}", key=f"take_{mi}_{di}"):
-                    dose["taken"] = True
-                    dose["taken_time"] = datetime.now()
-                    
-                    MOTIVATION_QUOTES = [
-                        "Excellent job! Your health is your wealth. 💪",
-                        "Consistency is key! You're doing great. ✨",
-                        "One step at a time, you're looking after yourself well! ❤️",
-                        "Way to go! Keeping up with your health is a big win today. 🏆",
-                        "You're doing a fantastic job staying on track! 🌈",
-                        "Your future self will thank you for being so diligent. 💖",
-                        "Keep it up! Small habits lead to big results. 🚀"
-                    ]
-                    st.session_state.motivation_quote = random.choice(MOTIVATION_QUOTES)
-                    
-                    updated_json = json.dumps([{
-                        "datetime": d["datetime"].strftime("%Y-%m-%d %H:%M:%S"),
-                        "taken": d["taken"],
-                        "taken_time": d["taken_time"].strftime("%Y-%m-%d %H:%M:%S") if d.get("taken_time") else None
-                    } for d in med["doses"]])
-                    
-                    cur.execute(
-                        "UPDATE medicines SET doses_json=? WHERE username=? AND med_name=?",
-                        (updated_json, st.session_state.user, med["name"])
-                    )
-                    conn.commit()
-                    st.rerun()
+        for index, entry in enumerate(timeline["entries"]):
+            med, dose, mi, di = entry["med"], entry["dose"], entry["mi"], entry["di"]
+            st.markdown(f"### 💊 {med['name']}")
+            st.write(f"⏰ {dose['datetime'].strftime('%H:%M')}")
+        
+            # DETERMINE STATUS
+            status = dose_status(timeline, index)
+            if status == "taken":
+                st.success(t("status_taken"))
+            elif status == "now":
+                st.success(f"🌟 {t('status_now')}")
+            elif status == "missed":
+                st.error(t("status_missed"))
+            else:
+                st.warning(t("status_upcoming"))
 
-                if c2.button(f"✏️ {t('btn_edit')}", key=f"edit_{mi}_{di}"):
-                    st.session_state.edit_med = mi
-                    st.session_state.page = "Add Medicine"
-                    st.rerun()
+            # ACTION BUTTONS
+            c1, c2, c3 = st.columns(3)
+
+            if c1.button(f"✅ {t('btn_taken')}", key=f"take_{mi}_{di}"):
+                dose["taken"] = True
+                dose["taken_time"] = datetime.now()
+            
+                MOTIVATION_QUOTES = [
+                    "Excellent job! Your health is your wealth. 💪",
+                    "Consistency is key! You're doing great. ✨",
+                    "One step at a time, you're looking after yourself well! ❤️",
+                    "Way to go! Keeping up with your health is a big win today. 🏆",
+                    "You're doing a fantastic job staying on track! 🌈",
+                    "Your future self will thank you for being so diligent. 💖",
+                    "Keep it up! Small habits lead to big results. 🚀"
+                ]
+                st.session_state.motivation_quote = random.choice(MOTIVATION_QUOTES)
+            
+                updated_json = json.dumps([{
+                    "datetime": d["datetime"].strftime("%Y-%m-%d %H:%M:%S"),
+                    "taken": d["taken"],
+                    "taken_time": d["taken_time"].strftime("%Y-%m-%d %H:%M:%S") if d.get("taken_time") else None
+                } for d in med["doses"]])
+            
+                cur.execute(
+                    "UPDATE medicines SET doses_json=? WHERE username=? AND med_name=?",
+                    (updated_json, st.session_state.user, med["name"])
+                )
+                conn.commit()
+                st.rerun()
+
+            if c2.button(f"✏️ {t('btn_edit')}", key=f"edit_{mi}_{di}"):
+                st.session_state.edit_med = mi
+                st.session_state.page = "Add Medicine"
+                st.rerun()
 
-                if c3.button(f"🗑 {t('btn_del')}", key=f"del_{mi}_{di}"):
-                    to_delete = mi
+            if c3.button(f"🗑 {t('btn_del')}", key=f"del_{mi}_{di}"):
+                to_delete = mi
 
-                st.divider()
+            st.divider()
 
     # DELETE MEDICINE IF REQUESTED
     if to_delete is not None:
@@ -545,6 +916,7 @@ if st.session_state.page == "Today's Checklist":
                     (st.session_state.user, med_to_remove))
         conn.commit()
         st.session_state.meds.pop(to_delete)
+        st.session_state.timeline = None
         st.rerun()
 
     # IF NO MEDICINES TODAY
@@ -555,131 +927,136 @@ if st.session_state.page == "Today's Checklist":
     # --------------------------------------------------
     # DAILY ADHERENCE SCORE (SMALL CIRCLE)
     # --------------------------------------------------
-    total = sum(len(m["doses"]) for m in st.session_state.meds)
-    taken = sum(d["taken"] for m in st.session_state.meds for d in m["doses"])
+    archived_taken, archived_total = st.session_state.archived_totals
+    total = archived_total + sum(len(m["doses"]) for m in st.session_state.meds)
+    taken = archived_taken + sum(d["taken"] for m in st.session_state.meds for d in m["doses"])
     score = int((taken / total) * 100) if total else 0
 
     st.subheader(t("adherence_score"))
 
-    fig, ax = plt.subplots(figsize=(4, 4))
-    values = [score, 100 - score]
-    colors = ["#4CAF50", "#E0E0E0"]
+    with profile_section("adherence_chart"):
+        fig, ax = plt.subplots(figsize=(4, 4))
+        values = [score, 100 - score]
+        pie_colors = ["#4CAF50", "#E0E0E0"]
 
-    ax.pie(
-        values,
-        startangle=90,
-        colors=colors,
-        wedgeprops=dict(width=0.7, edgecolor="white")
-    )
+        ax.pie(
+            values,
+            startangle=90,
+            colors=pie_colors,
+            wedgeprops=dict(width=0.7, edgecolor="white")
+        )
 
-    ax.text(0, 0, f"{score}%", ha="center", va="center",
-            fontsize=15, fontweight="bold")
-    ax.axis("off")
-    ax.set(aspect="equal")
+        ax.text(0, 0, f"{score}%", ha="center", va="center",
+                fontsize=15, fontweight="bold")
+        ax.axis("off")
+        ax.set(aspect="equal")
 
-    buf = io.BytesIO()
-    fig.savefig(buf, format="png", transparent=True)
-    buf.seek(0)
-    st.image(buf, width=180)
-    plt.close(fig)
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", transparent=True)
+        buf.seek(0)
+        st.image(buf, width=180)
+        plt.close(fig)
 
     # --------------------------------------------------
     # WEEKLY ADHERENCE (LAST 7 DAYS - BAR GRAPH)
     # --------------------------------------------------
     st.subheader("📊 Weekly Adherence (Last 7 Days)")
 
-    today = date.today()
-    days = [today - timedelta(days=i) for i in range(6, -1, -1)]
-    labels = [d.strftime("%a") for d in days]
-
-    daily_total = {d: 0 for d in days}
-    daily_taken = {d: 0 for d in days}
-
-    for med in st.session_state.meds:
-        for dose in med["doses"]:
-            d_date = dose["datetime"].date()
-            if d_date in daily_total:
-                daily_total[d_date] += 1
-                if dose["taken"]:
-                    daily_taken[d_date] += 1
+    with profile_section("weekly_chart"):
+        today = date.today()
+        days = [today - timedelta(days=i) for i in range(6, -1, -1)]
+        labels = [d.strftime("%a") for d in days]
 
-    weekly_scores = [
-        int((daily_taken[d] / daily_total[d]) * 100) if daily_total[d] else 0
-        for d in days
-    ]
+        daily_total = {d: 0 for d in days}
+        daily_taken = {d: 0 for d in days}
 
-    fig = go.Figure(
-        data=[
-            go.Bar(
-                x=labels,
-                y=weekly_scores,
-                text=[f"{v}%" for v in weekly_scores],
-                textposition="outside",
-                marker_color="#42A5F5"
-            )
+        for med in st.session_state.meds:
+            for dose in med["doses"]:
+                d_date = dose["datetime"].date()
+                if d_date in daily_total:
+                    daily_total[d_date] += 1
+                    if dose["taken"]:
+                        daily_taken[d_date] += 1
+
+        weekly_scores = [
+            int((daily_taken[d] / daily_total[d]) * 100) if daily_total[d] else 0
+            for d in days
         ]
-    )
 
-    fig.update_layout(
-        height=280,
-        yaxis=dict(range=[0, 100], title="Adherence %"),
-        xaxis=dict(title="Day"),
-        margin=dict(l=30, r=30, t=30, b=30),
-        plot_bgcolor="rgba(0,0,0,0)",
-        paper_bgcolor="rgba(0,0,0,0)"
-    )
+        fig = go.Figure(
+            data=[
+                go.Bar(
+                    x=labels,
+                    y=weekly_scores,
+                    text=[f"{v}%" for v in weekly_scores],
+                    textposition="outside",
+                    marker_color="#42A5F5"
+                )
+            ]
+        )
+
+        fig.update_layout(
+            height=280,
+            yaxis=dict(range=[0, 100], title="Adherence %"),
+            xaxis=dict(title="Day"),
+            margin=dict(l=30, r=30, t=30, b=30),
+            plot_bgcolor="rgba(0,0,0,0)",
+            paper_bgcolor="rgba(0,0,0,0)"
+        )
 
-    st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(fig, use_container_width=True)
 
 
     # PDF Generation
     if st.button(f"📄 {t('btn_pdf')}"):
-        styles = getSampleStyleSheet()
-        status_style = styles["Normal"].clone("StatusStyle")
-        status_style.alignment = 1 
+        with profile_section("pdf_report"):
+            styles = getSampleStyleSheet()
+            status_style = styles["Normal"].clone("StatusStyle")
+            status_style.alignment = 1 
         
-        elements = []
-        elements.append(Paragraph(f"<b>{t('pdf_report_title')}</b>", styles["Title"]))
-        elements.append(Paragraph(f"<b>Patient:</b> {st.session_state.user} | <b>Age:</b> {st.session_state.age}", styles["Normal"]))
-        elements.append(Paragraph(f"<b>Generated on:</b> {date.today().strftime('%d-%m-%Y')}", styles["Normal"]))
-        elements.append(Paragraph("<br/><br/>", styles["Normal"]))
-
-        table_data = [[t("col_date"), t("col_day"), t("col_med"), t("col_sched"), t("col_taken"), t("col_status")]]
-        TOLERANCE = 15
-
-        for med in st.session_state.meds:
-            for d in med["doses"]:
-                sched_dt = d["datetime"]
-                taken_dt = d["taken_time"]
+            elements = []
+            elements.append(Paragraph(f"<b>{t('pdf_report_title')}</b>", styles["Title"]))
+            elements.append(Paragraph(f"<b>Patient:</b> {st.session_state.user} | <b>Age:</b> {st.session_state.age}", styles["Normal"]))
+            elements.append(Paragraph(f"<b>Generated on:</b> {date.today().strftime('%d-%m-%Y')}", styles["Normal"]))
+            elements.append(Paragraph("<br/><br/>", styles["Normal"]))
+
+            table_data = [[t("col_date"), t("col_day"), t("col_med"), t("col_sched"), t("col_taken"), t("col_status")]]
+            TOLERANCE = 15
+
+            # Archived courses are only decompressed when a report is built
+            for med in load_archived_meds(cur, st.session_state.user) + st.session_state.meds:
+                for d in med["doses"]:
+                    sched_dt = d["datetime"]
+                    taken_dt = d["taken_time"]
                 
-                if d["taken"] and taken_dt:
-                    diff = (taken_dt - sched_dt).total_seconds() / 60
-                    taken_str = taken_dt.strftime("%H:%M")
-                    if abs(diff) <= TOLERANCE:
-                        status_text, status_color = "Taken on time", "green"
+                    if d["taken"] and taken_dt:
+                        diff = (taken_dt - sched_dt).total_seconds() / 60
+                        taken_str = taken_dt.strftime("%H:%M")
+                        if abs(diff) <= TOLERANCE:
+                            status_text, status_color = "Taken on time", "green"
+                        else:
+                            status_text, status_color = "Taken early/late", "#CCCC00"
                     else:
-                        status_text, status_color = "Taken early/late", "#CCCC00"
-                else:
-                    status_text, status_color, taken_str = "Not taken", "red", "-"
+                        status_text, status_color, taken_str = "Not taken", "red", "-"
 
-                colored_status = Paragraph(f'<b><font color="{status_color}">{status_text}</font></b>', status_style)
-                table_data.append([sched_dt.strftime("%d-%m-%Y"), sched_dt.strftime("%A"), med["name"], sched_dt.strftime("%H:%M"), taken_str, colored_status])
+                    colored_status = Paragraph(f'<b><font color="{status_color}">{status_text}</font></b>', status_style)
+                    table_data.append([sched_dt.strftime("%d-%m-%Y"), sched_dt.strftime("%A"), med["name"], sched_dt.strftime("%H:%M"), taken_str, colored_status])
 
-        report_table = Table(table_data, colWidths=[75, 85, 90, 70, 70, 120])
-        report_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ]))
-        elements.append(report_table)
+            report_table = Table(table_data, colWidths=[75, 85, 90, 70, 70, 120])
+            report_table.setStyle(TableStyle([
+                ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ]))
+            elements.append(report_table)
 
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-        doc = SimpleDocTemplate(tmp.name, pagesize=A4)
-        doc.build(elements)
+            tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
+            doc = SimpleDocTemplate(tmp.name, pagesize=A4)
+            doc.build(elements)
 
-        with open(tmp.name, "rb") as f:
-            st.download_button(label=t("btn_download_pdf"), data=f, file_name=f"Medical_Report_{st.session_state.user}.pdf", mime="application/pdf")
+            with open(tmp.name, "rb") as f:
+                st.download_button(label=t("btn_download_pdf"), data=f, file_name=f"Medical_Report_{st.session_state.user}.pdf", mime="application/pdf")
 
 # --------------------------------------------------
 # PAGE: SETTINGS
@@ -725,6 +1102,31 @@ if st.session_state.page == "Settings":
             else: 
                 st.error("Error updating credentials")
 
+    if PROFILING and st.session_state.user in PROFILE_ADMINS:
+        st.divider()
+        st.subheader("⏱ Profiling")
+        store = get_profile_store()
+        with store["lock"]:
+            timings = dict(store["timings"])
+            sections = sorted(store["stats"])
+        st.table([
+            {"Section": name, "Runs": count, "Total (s)": round(total, 3), "Mean (ms)": round(total / count * 1000, 1)}
+            for name, (count, total) in sorted(timings.items(), key=lambda item: -item[1][1])
+        ])
+        if sections:
+            section = st.selectbox("Section", ["All sections"] + sections)
+            st.download_button(
+                label="⬇️ Download Profile",
+                data=export_profile(None if section == "All sections" else section),
+                file_name=f"medtimer_{section.replace(' ', '_').lower()}.prof",
+                mime="application/octet-stream"
+            )
+        if st.button("Reset Profile"):
+            with store["lock"]:
+                store["stats"].clear()
+                store["timings"].clear()
+            st.rerun()
+
 # --------------------------------------------------
 # NAVIGATION FOOTER
 # --------------------------------------------------
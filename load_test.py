@@ -0,0 +1,280 @@
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import statistics
+import tempfile
+import time as time_mod
+from datetime import datetime, date, timedelta
+
+from streamlit.testing.v1 import AppTest
+
+
+# --------------------------------------------------
+# LOAD TEST FOR MEDTIMER
+# --------------------------------------------------
+# Drives many simulated Streamlit sessions through the real MedTimer.py:
+# sign up, login, add a medicine, open the checklist, mark that dose as
+# taken, build the PDF report and sit on the checklist while the page's
+# 60 second auto-refresh reruns it.
+#
+# AppTest keeps process-global runtime state, so every session runs in its
+# own process with its own cached connections. All of them share one
+# MEDTIMER_DATA_DIR, so this measures per-rerun cost and SQLite contention
+# between processes on the same shard files. It does NOT model sessions
+# sharing one `streamlit run` process (one cached connection, one GIL).
+#
+#   python load_test.py --sessions 20 --iterations 3
+# --------------------------------------------------
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "MedTimer.py")
+STEPS = ["signup", "login", "navigate", "add_medicine", "checklist", "mark_taken", "pdf_export", "idle_rerun"]
+DB_KINDS = ["read", "write", "commit"]
+
+
+# --------------------------------------------------
+# DATABASE CALL TIMING
+# --------------------------------------------------
+# SQLite does not report how long a statement waited on its busy timeout,
+# so every execute/commit the app makes is timed instead. Inside a worker
+# process sqlite3.connect is patched to hand out these timing connections.
+db_calls = {kind: [] for kind in DB_KINDS}
+db_lock_errors = [0]
+
+
+def timed_call(kind, func, *args):
+    start = time_mod.perf_counter()
+    try:
+        return func(*args)
+    except sqlite3.OperationalError as e:
+        if "locked" in str(e):
+            db_lock_errors[0] += 1
+        raise
+    finally:
+        db_calls[kind].append(time_mod.perf_counter() - start)
+
+
+def statement_kind(sql):
+    return "read" if sql.lstrip().upper().startswith(("SELECT", "PRAGMA")) else "write"
+
+
+class TimingCursor(sqlite3.Cursor):
+    def execute(self, sql, *args):
+        return timed_call(statement_kind(sql), super().execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return timed_call(statement_kind(sql), super().executemany, sql, *args)
+
+
+class TimingConnection(sqlite3.Connection):
+    def cursor(self, factory=TimingCursor):
+        return super().cursor(factory)
+
+    # The C implementation of Connection.execute builds a plain Cursor
+    # without calling cursor(), so these shortcuts are routed explicitly
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+    def commit(self):
+        return timed_call("commit", super().commit)
+
+
+def install_db_timing():
+    original_connect = sqlite3.connect
+
+    def timing_connect(*args, **kwargs):
+        kwargs.setdefault("factory", TimingConnection)
+        return original_connect(*args, **kwargs)
+
+    sqlite3.connect = timing_connect
+
+
+# --------------------------------------------------
+# SIMULATED SESSION (ONE PER PROCESS)
+# --------------------------------------------------
+def find_button(at, label):
+    for b in at.button:
+        if b.label == label:
+            return b
+    raise LookupError(f"Button not found: {label}")
+
+
+def run_step(result, step, action):
+    start = time_mod.perf_counter()
+    try:
+        at = action()
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+    except Exception as e:
+        result["failures"][step] += 1
+        result["errors"].append((step, f"{type(e).__name__}: {e}"))
+        return False
+    result["latency"][step].append(time_mod.perf_counter() - start)
+    return True
+
+
+def run_session(session_id, iterations, idle_reruns, reload_interval, timeout):
+    install_db_timing()
+    result = {
+        "latency": {step: [] for step in STEPS},
+        "failures": {step: 0 for step in STEPS},
+        "errors": [],
+    }
+
+    username = f"loadtest_{session_id}_{os.getpid()}"
+    password = "loadtest"
+    at = AppTest.from_file(APP_FILE, default_timeout=timeout)
+
+    def signup():
+        at.run()
+        at.text_input[2].input("Load Test")
+        at.text_input[3].input(username)
+        at.text_input[4].input(password)
+        return find_button(at, "Create Account").click().run()
+
+    def login():
+        at.text_input[0].input(username)
+        at.text_input[1].input(password)
+        return find_button(at, "Login").click().run()
+
+    def navigate(label):
+        return find_button(at, label).click().run()
+
+    def add_medicine(round_no):
+        # Schedule the dose a minute from now so it is on today's checklist
+        dose_time = (datetime.now() + timedelta(minutes=1)).time().replace(second=0, microsecond=0)
+        at.text_input[0].input(f"Med {session_id}-{round_no}")
+        at.date_input[0].set_value(date.today())
+        at.time_input[0].set_value(dose_time)
+        return find_button(at, "Save Medicine").click().run()
+
+    def mark_taken(round_no):
+        # Medicines are appended in order, so this round's medicine is index
+        # round_no and its first dose (today) is index 0
+        return at.button(key=f"take_{round_no}_0").click().run()
+
+    def idle_rerun():
+        return at.run()
+
+    steps = [("signup", signup), ("login", login)]
+    for round_no in range(iterations):
+        if round_no:
+            steps.append(("navigate", lambda: navigate("➕ Add Medicine")))
+        steps += [
+            ("add_medicine", lambda r=round_no: add_medicine(r)),
+            ("checklist", lambda: navigate("📋 Today's Checklist")),
+            ("mark_taken", lambda r=round_no: mark_taken(r)),
+            ("pdf_export", lambda: navigate("📄 Download Report")),
+        ]
+        steps += [("idle_rerun", idle_rerun)] * idle_reruns
+
+    idle = 0.0
+    for step, action in steps:
+        # The auto-refresh wait is idle time, not part of the rerun latency
+        if step == "idle_rerun":
+            time_mod.sleep(reload_interval)
+            idle += reload_interval
+        # Every later step depends on this one having worked
+        if not run_step(result, step, action):
+            break
+
+    result["idle"] = idle
+    result["db_calls"] = db_calls
+    result["db_lock_errors"] = db_lock_errors[0]
+    return result
+
+
+# --------------------------------------------------
+# REPORT
+# --------------------------------------------------
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def print_table(title, rows):
+    print(f"{title:<14}{'Count':>7}{'Fail':>6}{'Mean':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'Max':>9}")
+    for name, values, failures in rows:
+        if not values and not failures:
+            continue
+        print(f"{name:<14}{len(values):>7}{failures:>6}"
+              f"{(statistics.mean(values) if values else 0) * 1000:>9.1f}"
+              f"{percentile(values, 50) * 1000:>9.1f}"
+              f"{percentile(values, 90) * 1000:>9.1f}"
+              f"{percentile(values, 99) * 1000:>9.1f}"
+              f"{max(values, default=0) * 1000:>9.1f}")
+    print("(times in ms)")
+    print()
+
+
+def print_report(results, elapsed, sessions, lock_threshold):
+    latency = {step: [v for r in results for v in r["latency"][step]] for step in STEPS}
+    failures = {step: sum(r["failures"][step] for r in results) for step in STEPS}
+    calls = {kind: [v for r in results for v in r["db_calls"][kind]] for kind in DB_KINDS}
+    completed = sum(len(v) for v in latency.values())
+    # Sessions sleep concurrently, so take the longest idle time off the wall
+    # time to get throughput while they were actually rerunning
+    idle = max((r["idle"] for r in results), default=0.0)
+    busy = max(elapsed - idle, 1e-9)
+
+    print()
+    print(f"Sessions: {sessions}   Wall time: {elapsed:.2f}s   Idle (auto-refresh waits): {idle:.2f}s   "
+          f"Completed reruns: {completed}   Throughput: {completed / busy:.2f} reruns/s (excluding idle)")
+    print()
+    print_table("Step", [(step, latency[step], failures[step]) for step in STEPS])
+    print_table("DB call", [(kind, calls[kind], 0) for kind in DB_KINDS])
+
+    # A write or commit slower than the threshold was almost certainly
+    # waiting for another connection to release the shard's lock
+    slow = [v for kind in ("write", "commit") for v in calls[kind] if v * 1000 >= lock_threshold]
+    print(f"Lock waits (writes/commits >= {lock_threshold:g}ms): {len(slow)}   "
+          f"total waited: {sum(slow):.2f}s   "
+          f"'database is locked' errors: {sum(r['db_lock_errors'] for r in results)}")
+
+    errors = [e for r in results for e in r["errors"]]
+    if errors:
+        print()
+        print(f"Errors ({len(errors)}):")
+        for step, message in errors[:10]:
+            print(f"  {step}: {message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent MedTimer sessions")
+    parser.add_argument("--sessions", type=int, default=10, help="number of concurrent sessions (one process each)")
+    parser.add_argument("--iterations", type=int, default=3, help="add/check/take/export rounds per session")
+    parser.add_argument("--idle-reruns", type=int, default=1, help="auto-refresh reruns on the checklist per round")
+    parser.add_argument("--reload-interval", type=float, default=60, help="seconds between auto-refresh reruns")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds allowed per rerun")
+    parser.add_argument("--lock-threshold", type=float, default=10, help="ms after which a write counts as a lock wait")
+    parser.add_argument("--data-dir", default=None, help="database directory (default: a fresh temp dir)")
+    args = parser.parse_args()
+
+    # MedTimer reads its storage location at import time; worker processes
+    # inherit this, so every session uses the same shard files
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="medtimer_load_")
+    os.makedirs(data_dir, exist_ok=True)
+    os.environ["MEDTIMER_DATA_DIR"] = data_dir
+    print(f"Data directory: {data_dir}")
+
+    session_args = [
+        (i, args.iterations, args.idle_reruns, args.reload_interval, args.timeout)
+        for i in range(args.sessions)
+    ]
+    start = time_mod.perf_counter()
+    # maxtasksperchild=1 keeps each session in a fresh process of its own
+    with multiprocessing.get_context("spawn").Pool(args.sessions, maxtasksperchild=1) as pool:
+        results = pool.starmap(run_session, session_args)
+    elapsed = time_mod.perf_counter() - start
+
+    print_report(results, elapsed, args.sessions, args.lock_threshold)
+
+
+if __name__ == "__main__":
+    main()